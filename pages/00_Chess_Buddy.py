@@ -1,19 +1,27 @@
 import streamlit as st
 from openai import OpenAI
-from streamlit_chat import message
 from dotenv import load_dotenv
 import os
 import json
+import glob
+import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import chess
 import chess.svg
 
 # Load environment variables and system prompt
 load_dotenv()
 
-try:
+@st.cache_resource
+def load_system_prompt():
+    """Read the system prompt once per process instead of on every rerun"""
     with open('prompt/system.md', 'r', encoding='utf-8') as file:
-        SYSTEM_PROMPT = file.read()
+        return file.read()
+
+try:
+    SYSTEM_PROMPT = load_system_prompt()
 except Exception as e:
     st.error(f"Error loading system prompt: {e}")
     SYSTEM_PROMPT = """You are a witty chess assistant playing a game against the user. You are playing as White. You should:
@@ -23,64 +31,150 @@ except Exception as e:
     4. Use casual language and occasional emojis
     5. Always format your move clearly at the start of your response"""
 
+# Number of recent messages sent verbatim; older ones are folded into a summary
+HISTORY_WINDOW = 20
+# Refresh the summary once this many messages have left the window
+SUMMARY_EVERY = 10
+
 # Available models
 MODELS = {
     "GPT-4 Optimized Mini": "gpt-4o-mini",
     "GPT-4 Optimized": "gpt-4o"
 }
 
-# Initialize OpenAI client
-def init_openai():
+# Shared OpenAI client (one connection pool for all sessions)
+@st.cache_resource
+def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         st.error("Please set OPENAI_API_KEY in your .env file")
         st.stop()
     return OpenAI(api_key=api_key)
 
-def save_game_state(messages, board):
-    """Save game state to a JSON file"""
+# Background writer so saving never delays the chat; a single worker keeps
+# appends to a session file in order
+@st.cache_resource
+def get_save_executor():
+    return ThreadPoolExecutor(max_workers=1)
+
+def new_session_path():
+    """Allocate the JSONL file that one game session appends to; the random
+    suffix keeps sessions started in the same second apart"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    game_state = {
-        "messages": messages,
-        "board_fen": board.fen(),
-        "timestamp": timestamp
-    }
-    
+    return f"data/session_{timestamp}_{uuid.uuid4().hex[:8]}.jsonl"
+
+def save_game_state(path, messages, fen):
+    """Append the latest move and reply to the session's JSONL file"""
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
     
-    filename = f"data/session_{timestamp}.json"
-    with open(filename, 'w') as f:
-        json.dump(game_state, f)
-    return filename
+    user_msg, assistant_msg = messages[-2]["content"], messages[-1]["content"]
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"move": user_msg, "reply": assistant_msg, "fen": fen}) + "\n")
+    return path
+
+def report_save_error(errors, future):
+    """Done-callback for background saves; runs in the worker thread, so the
+    error is queued for the page to show on its next run"""
+    error = future.exception()
+    if error is not None:
+        print(f"Error saving game state: {error}")
+        errors.append(str(error))
+
+def load_game_state(path):
+    """Rebuild the chat messages and board from a session JSONL file"""
+    messages = []
+    board = chess.Board()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            messages.append({"role": "user", "content": entry["move"]})
+            messages.append({"role": "assistant", "content": entry["reply"]})
+            # Moves are free text, so the recorded FEN is the source of truth
+            board = chess.Board(entry["fen"])
+    return messages, board
 
-def get_chat_response(client, messages, board):
-    """Get response from OpenAI with game context"""
+@st.cache_data(ttl=3600)
+def render_board_svg(fen: str) -> str:
+    """Render the board SVG for a position, memoized on its FEN"""
+    return chess.svg.board(board=chess.Board(fen))
+
+def summarize_history(client, messages, previous_summary):
+    """Fold older chat messages into a short running summary of the game"""
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Summarize this chess game conversation in one or two sentences: the moves played so far and any notable moments."},
+            {"role": "user", "content": f"Summary so far: {previous_summary or 'none'}\n\nNew messages:\n{transcript}"}
+        ],
+        temperature=0,
+        max_tokens=100
+    )
+    return response.choices[0].message.content
+
+def get_chat_response(client, messages, board, fen=None):
+    """Stream a response from OpenAI with game context"""
     system_message = {
         "role": "system", 
         "content": SYSTEM_PROMPT
     }
     
-    # Create game history context
-    game_history = {
-        "board_state": board.fen(),
-        "moves": [msg["content"] for msg in messages]
-    }
-    
-    # Create context message
-    context_message = {
-        "role": "user",
-        "content": f"This is the game history: {json.dumps(game_history, indent=2)}"
-    }
+    # Keep the system prompt as a stable prefix for prompt caching and put
+    # the volatile position into the latest user turn only
+    full_messages = [system_message]
     
-    full_messages = [system_message, context_message] + messages
+    # Bound the request size: send only the latest messages plus a summary
+    older = messages[:-HISTORY_WINDOW]
+    if older:
+        summarized = st.session_state.get("summarized_count", 0)
+        if len(older) - summarized >= SUMMARY_EVERY:
+            st.session_state.history_summary = summarize_history(
+                client,
+                older[summarized:],
+                st.session_state.get("history_summary", "")
+            )
+            st.session_state.summarized_count = len(older)
+        if st.session_state.get("history_summary"):
+            full_messages.append({
+                "role": "system",
+                "content": f"Summary of earlier moves: {st.session_state.history_summary}"
+            })
+    full_messages += messages[-HISTORY_WINDOW:]
+    if full_messages[-1]["role"] == "user":
+        full_messages[-1] = {
+            "role": "user",
+            "content": f"[FEN {fen or board.fen()}] {full_messages[-1]['content']}"
+        }
     
-    response = client.chat.completions.create(
+    stream = client.chat.completions.create(
         model=st.session_state.selected_model,
         messages=full_messages,
-        temperature=0.1
+        temperature=0,  # Deterministic moves also reuse the prompt cache better
+        max_tokens=200,
+        stop=["\n\n\n"],
+        stream=True
     )
-    return response.choices[0].message.content
+    for chunk in stream:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+def reset_game():
+    """Button callback; runs before the rerun so no second rerun is needed"""
+    st.session_state.board = chess.Board()
+    st.session_state.messages = []
+    st.session_state.session_path = new_session_path()
+    st.session_state.history_summary = ""
+    st.session_state.summarized_count = 0
+
+def resume_game(path):
+    """Button callback; continues a saved session, appending to its file"""
+    st.session_state.messages, st.session_state.board = load_game_state(path)
+    st.session_state.session_path = path
+    st.session_state.history_summary = ""
+    st.session_state.summarized_count = 0
 
 # Initialize the Streamlit interface
 st.title("Chess AI Agent")
@@ -88,22 +182,30 @@ st.title("Chess AI Agent")
 # Initialize session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+    st.session_state.session_path = new_session_path()
     # Add initial message
     init_message = "You have whites. What is your first move?"
     st.session_state.messages.append({"role": "user", "content": init_message})
-if 'openai_client' not in st.session_state:
-    st.session_state.openai_client = init_openai()
 if 'board' not in st.session_state:
     st.session_state.board = chess.Board()
+if 'save_errors' not in st.session_state:
+    st.session_state.save_errors = []
+# Build the FEN string once per rerun and reuse it below
+fen = st.session_state.board.fen()
 if 'selected_model' not in st.session_state:
     st.session_state.selected_model = MODELS["GPT-4 Optimized Mini"]  # Default model
     # Get initial AI response
     if len(st.session_state.messages) == 1:  # Only user's initial message exists
-        response = get_chat_response(
-            st.session_state.openai_client,
-            st.session_state.messages,
-            st.session_state.board
-        )
+        # Stream into a placeholder; the chat history below renders the final message
+        placeholder = st.empty()
+        with placeholder:
+            response = st.write_stream(get_chat_response(
+                get_openai_client(),
+                st.session_state.messages,
+                st.session_state.board,
+                fen
+            ))
+        placeholder.empty()
         st.session_state.messages.append({"role": "assistant", "content": response})
 
 # Sidebar
@@ -119,58 +221,78 @@ with st.sidebar:
     # Display game history
     st.header("Game History")
     if st.session_state.messages:
-        game_history = {
-            "board_state": st.session_state.board.fen(),
-            "moves": [msg["content"] for msg in st.session_state.messages]
-        }
-        st.json(game_history)
+        st.json({
+            "board_state": fen,
+            "n_moves": len(st.session_state.messages)
+        })
+        # Only build the full dump on demand
+        if st.checkbox("Show full history"):
+            st.json({"moves": [msg["content"] for msg in st.session_state.messages]})
     else:
         st.write("No moves yet")
     
     # Move reset button to sidebar
-    if st.button("Reset Game"):
-        st.session_state.board = chess.Board()
-        st.session_state.messages = []
-        st.rerun()
+    st.button("Reset Game", on_click=reset_game)
+    
+    # Resume an earlier game; timestamped names sort newest first
+    saved_sessions = sorted(glob.glob("data/session_*.jsonl"), reverse=True)
+    if saved_sessions:
+        st.header("Saved Games")
+        resume_path = st.selectbox("Saved game", saved_sessions, format_func=os.path.basename)
+        st.button("Resume Game", on_click=resume_game, args=(resume_path,))
+
+# Surface background save failures from earlier turns
+while st.session_state.save_errors:
+    st.error(f"Error saving game state: {st.session_state.save_errors.pop(0)}")
 
 # Display current board state
-board_svg = chess.svg.board(board=st.session_state.board)
+board_svg = render_board_svg(fen)
 st.write(f'<div style="width: 600px; margin: auto;">{board_svg}</div>', unsafe_allow_html=True)
-st.caption(f"Current position: {st.session_state.board.fen()}")
+st.caption(f"Current position: {fen}")
 
 # Chat interface
 st.subheader("Game Progress")
 
-# Display chat history
-for i, msg in enumerate(st.session_state.messages):
-    message(
-        msg["content"],
-        is_user=(msg["role"] == "user"),
-        key=f"msg_{i}"
-    )
-
-# User input at the bottom
-user_input = st.text_input("Your move:", key="user_input")
-
-if user_input and user_input != st.session_state.get('last_input', ''):
-    # Store current input to prevent duplicate processing
-    st.session_state.last_input = user_input
-    
-    # Add user message to chat
-    st.session_state.messages.append({"role": "user", "content": f"I play: {user_input}"})
-    
-    # Get AI response
-    response = get_chat_response(
-        st.session_state.openai_client,
-        st.session_state.messages,
-        st.session_state.board
-    )
+@st.fragment
+def chat_panel():
+    """Chat history and move input; reruns on its own without redrawing the page"""
+    # Display chat history
+    history_container = st.container()
+    for msg in st.session_state.messages:
+        history_container.chat_message(msg["role"]).write(msg["content"])
     
-    # Add AI response to chat
-    st.session_state.messages.append({"role": "assistant", "content": response})
+    # User input at the bottom
+    user_input = st.text_input("Your move:", key="user_input")
     
-    # Save game state
-    save_game_state(st.session_state.messages, st.session_state.board)
-    
-    # Rerun to update the display
-    st.rerun()
+    if user_input and user_input != st.session_state.get('last_input', ''):
+        # Store current input to prevent duplicate processing
+        st.session_state.last_input = user_input
+        
+        # Add user message to chat and draw only the new turn
+        user_message = f"I play: {user_input}"
+        st.session_state.messages.append({"role": "user", "content": user_message})
+        history_container.chat_message("user").write(user_message)
+        
+        # Stream AI response into its chat bubble as it is generated
+        with history_container.chat_message("assistant"):
+            response = st.write_stream(get_chat_response(
+                get_openai_client(),
+                st.session_state.messages,
+                st.session_state.board,
+                fen
+            ))
+        
+        # Add AI response to chat
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        
+        # Save game state in the background; pass a copy of the new turn since
+        # the session's message list keeps changing
+        future = get_save_executor().submit(
+            save_game_state,
+            st.session_state.session_path,
+            st.session_state.messages[-2:],
+            fen
+        )
+        future.add_done_callback(partial(report_save_error, st.session_state.save_errors))
+
+chat_panel()
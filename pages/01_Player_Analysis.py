@@ -3,19 +3,63 @@ from openai import OpenAI
 from streamlit_chat import message
 from dotenv import load_dotenv
 import os
-from utils.query import search_games
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.query import EXAMPLE_QUERIES, answer_query, current_index_id, load_example_cache
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-def init_openai():
+# Shared OpenAI client (one connection pool for all sessions)
+@st.cache_resource
+def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         st.error("Please set OPENAI_API_KEY in your .env file")
         st.stop()
     return OpenAI(api_key=api_key)
 
+# Example answers precomputed by tasks/prewarm_examples.py; keyed on the index
+# so a rebuilt index never serves answers from the old one
+@st.cache_data(ttl=600)
+def get_example_cache(index_id):
+    return load_example_cache(index_id)
+
+# Registry of in-flight searches so concurrent identical queries share one run
+@st.cache_resource
+def get_inflight():
+    return {"lock": threading.Lock(), "futures": {}}
+
+@st.cache_resource
+def get_search_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+# Exceptions are not cached, so failed searches (e.g. no index yet) are retried next time
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_search(query, num_results=3):
+    """Run answer_query, joining an identical search already in progress"""
+    inflight = get_inflight()
+    key = (query, num_results)
+    with inflight["lock"]:
+        future = inflight["futures"].get(key)
+        if future is None:
+            future = get_search_executor().submit(
+                answer_query, query, get_openai_client(), num_results=num_results
+            )
+            inflight["futures"][key] = future
+    try:
+        return future.result()
+    finally:
+        with inflight["lock"]:
+            if inflight["futures"].get(key) is future:
+                del inflight["futures"][key]
+
+def run_search(query, num_results=3):
+    try:
+        return cached_search(query, num_results=num_results)
+    except ValueError as e:
+        return str(e)
+
 # Initialize Streamlit interface
 st.title("Chess Player Analysis")
 st.write("Ask questions about chess players and games in the database!")
@@ -23,26 +67,18 @@ st.write("Ask questions about chess players and games in the database!")
 # Initialize session state
 if 'analysis_messages' not in st.session_state:
     st.session_state.analysis_messages = []
-if 'openai_client' not in st.session_state:
-    st.session_state.openai_client = init_openai()
 
 # Sidebar with example queries
 with st.sidebar:
     st.header("Example Queries")
-    example_queries = [
-        "Show me Shabalov's best games as White",
-        "What are some interesting games from the World Senior Championships?",
-        "Find games with brilliant tactical combinations",
-        "Show games where underdogs defeated higher-rated players",
-        "What are some notable games in the Sicilian Defense?",
-    ]
-    
-    for query in example_queries:
+    for query in EXAMPLE_QUERIES:
         if st.button(query):
             st.session_state.analysis_messages.append({"role": "user", "content": query})
-            response = search_games(query, client=st.session_state.openai_client, num_results=3, return_str=True)
+            response = get_example_cache(current_index_id()).get(query)
+            if response is None:
+                response = run_search(query, num_results=3)
             st.session_state.analysis_messages.append({"role": "assistant", "content": response})
-            st.rerun()
+            # No rerun needed: the chat history below is drawn later in this run
 
 # Chat interface
 st.subheader("Analysis Chat")
@@ -66,7 +102,7 @@ if user_input and user_input != st.session_state.get('last_analysis_input', ''):
     st.session_state.analysis_messages.append({"role": "user", "content": user_input})
     
     # Get RAG response
-    response = search_games(user_input, client=st.session_state.openai_client, num_results=3, return_str=True)
+    response = run_search(user_input, num_results=3)
     
     # Add response to chat
     st.session_state.analysis_messages.append({"role": "assistant", "content": response})
@@ -74,7 +110,8 @@ if user_input and user_input != st.session_state.get('last_analysis_input', ''):
     # Rerun to update the display
     st.rerun()
 
-# Clear chat button
-if st.button("Clear Chat"):
+# Clear chat button; the callback runs before the rerun so no second rerun is needed
+def clear_chat():
     st.session_state.analysis_messages = []
-    st.rerun()
+
+st.button("Clear Chat", on_click=clear_chat)
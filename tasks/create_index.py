@@ -1,31 +1,63 @@
 import numpy as np
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import faiss
-from typing import List, Dict
-import pickle
+from typing import Iterable, Iterator, List, Tuple
 import json
 import os
 import uuid
 from datetime import datetime
 import glob
-import chess.pgn
 import io
+import mmap
+import hashlib
+import re
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import chess.pgn
+import math
+import sys
+from utils.embedding_cache import EmbeddingCache, text_hash
+from utils.openai_retry import openai_retry
+from utils.openai_batch import run_batch
+from utils.types import Chunk, Game
 
 # Load environment variables and set up OpenAI client
 load_dotenv()
-client = OpenAI()
+client = AsyncOpenAI()
+batch_client = OpenAI()  # Batch API file upload and polling are sync
 
 # Define constants
 EMBEDDING_MODEL = "text-embedding-3-large"
 MAX_TOKENS_PER_CHUNK = 6000  # text-embedding-3-large has 8k limit, leaving some headroom
 WORDS_PER_TOKEN = 0.75  # approximate ratio for English text
+EMBEDDING_BATCH_SIZE = 256  # inputs per embeddings request (API allows up to 2048)
+MAX_TOKENS_PER_REQUEST = 200000  # API allows 300k per request, leaving headroom for the estimate
+EMBEDDING_CONCURRENCY = 12  # embeddings requests in flight at once
+BATCH_MAX_INPUTS = 50000  # Batch API limit on embedding inputs across one batch
+BATCH_MAX_BYTES = 150 * 1024 * 1024  # input files may be up to 200 MB; leave room for JSON overhead
+FLAT_INDEX_MAX = 10000  # above this many vectors, exact search gets slow
+HNSW_M = 32  # graph neighbors per node
+HNSW_EF_CONSTRUCTION = 200
+PQ_M = 64  # sub-quantizers; must divide the embedding dimension (3072 for text-embedding-3-large)
+PQ_NBITS = 8
+PGN_MANIFEST_PATH = 'data/.pgn_manifest.json'  # (mtime, size, games) of each parsed PGN
+PGN_CACHE_DIR = 'data/.cache'  # parsed documents per PGN, one JSON row per game
+PGN_PARSER_VERSION = 1  # bump when _parse_one's output changes to invalidate the cache
 
 def chunk_text(text: str) -> List[str]:
     """Chunk text dynamically based on length while maintaining context.
-    Estimates token count using word count and adjusts chunk size accordingly."""
-    words = text.split()
-    total_words = len(words)
+    Estimates token count using word count and adjusts chunk size accordingly.
+    Chunks are single slices of the original text between word offsets."""
+    # n words need at least 2n - 1 characters, so short texts can never exceed
+    # the token estimate and need no word scan at all
+    if len(text) < 2 * MAX_TOKENS_PER_CHUNK * WORDS_PER_TOKEN:
+        return [text]
+    
+    spans = [match.span() for match in re.finditer(r'\S+', text)]
+    total_words = len(spans)
     
     # Estimate optimal chunk size (in words) based on text length
     estimated_tokens = total_words / WORDS_PER_TOKEN
@@ -37,136 +69,409 @@ def chunk_text(text: str) -> List[str]:
     overlap = 100
     
     chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append(chunk)
+    for i in range(0, total_words, chunk_size - overlap):
+        last = min(i + chunk_size, total_words) - 1
+        chunks.append(text[spans[i][0]:spans[last][1]])
     return chunks
 
-def load_pgn_files() -> List[Dict[str, str]]:
+def content_hash(text: str) -> bytes:
+    """Fixed-size 16-byte digest used for deduplication"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+GAME_BOUNDARY = b'\n\n[Event '
+
+def _iter_game_texts(pgn_file: str) -> Iterator[str]:
+    """Yield the text of each game in a PGN file. The file is memory-mapped and
+    split on the blank line before each [Event tag, so only one game at a time
+    is ever decoded."""
+    with open(pgn_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < len(mm):
+                end = mm.find(GAME_BOUNDARY, start + 1)
+                if end == -1:
+                    end = len(mm)
+                # Undecodable bytes are replaced rather than re-reading the file in other encodings
+                yield mm[start:end].decode('utf-8', errors='replace')
+                start = end + 2
+
+def _parse_one(pgn_file: str) -> Tuple[List[Tuple[bytes, Game]], int]:
+    """Parse one PGN file into documents; runs in a worker process.
+    Returns (game_key, document) pairs and the number of games read."""
+    print(f"Processing {pgn_file}...")
+    documents = []
+    source = sys.intern(os.path.basename(pgn_file))
+    game_count = 0
+    batch_size = 100  # Report progress every 100 games
+    
+    def iter_games():
+        for game_text in _iter_game_texts(pgn_file):
+            # A slice can hold more than one game when a game lacks an Event header
+            game_io = io.StringIO(game_text)
+            while (chess_game := chess.pgn.read_game(game_io)) is not None:
+                yield chess_game
+    
+    for chess_game in iter_games():
+        game_count += 1
+        if game_count % batch_size == 0:
+            print(f"Processed {game_count} games from {pgn_file}")
+        
+        try:
+            # Extract relevant information
+            headers = dict(chess_game.headers)
+            moves = ' '.join(move.uci() for move in chess_game.mainline_moves())
+            
+            # Create a richer description combining headers and moves
+            description = (
+                f"Event: {headers.get('Event', 'Unknown')} "
+                f"Site: {headers.get('Site', 'Unknown')} "
+                f"Date: {headers.get('Date', 'Unknown')} "
+                f"White: {headers.get('White', 'Unknown')} "
+                f"Black: {headers.get('Black', 'Unknown')} "
+                f"Result: {headers.get('Result', 'Unknown')} "
+                f"ECO: {headers.get('ECO', 'Unknown')} "
+                f"Moves: {moves}"
+            )
+            
+            # Identifies the same game appearing in overlapping PGN dumps
+            game_key = content_hash(
+                f"{headers.get('White')}|{headers.get('Black')}|{headers.get('Date')}|{moves}"
+            )
+            documents.append((game_key, Game(description, source)))
+        except Exception as e:
+            print(f"Error parsing game in {pgn_file}: {str(e)}")
+            continue
+
+    print(f"Successfully processed {game_count} games from {pgn_file}")
+    return documents, game_count
+
+def _parsed_cache_path(pgn_file: str) -> str:
+    return os.path.join(PGN_CACHE_DIR, os.path.basename(pgn_file) + '.jsonl')
+
+def _load_parsed(pgn_file: str) -> List[Tuple[bytes, Game]]:
+    """Read back the documents _save_parsed wrote for a PGN file"""
+    parsed = []
+    with open(_parsed_cache_path(pgn_file), 'r', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            parsed.append((bytes.fromhex(row['key']), Game(row['description'], sys.intern(row['source']))))
+    return parsed
+
+def _save_parsed(pgn_file: str, parsed: List[Tuple[bytes, Game]]):
+    os.makedirs(PGN_CACHE_DIR, exist_ok=True)
+    with open(_parsed_cache_path(pgn_file), 'w', encoding='utf-8') as f:
+        for game_key, document in parsed:
+            f.write(json.dumps({'key': game_key.hex(), **document._asdict()}) + '\n')
+
+def load_pgn_files() -> List[Game]:
     documents = []
-    pgn_files = glob.glob('data/*.pgn')
+    pgn_files = sorted(glob.glob('data/*.pgn'))
     total_games = 0
+    seen_games = set()
+    duplicate_games = 0
+    
+    # Only re-parse files whose mtime or size changed since the last run
+    manifest = {}
+    if os.path.exists(PGN_MANIFEST_PATH):
+        with open(PGN_MANIFEST_PATH, 'r') as f:
+            saved = json.load(f)
+        # Documents cached by another parser version may use an old description format
+        if saved.get('parser_version') == PGN_PARSER_VERSION:
+            manifest = saved['files']
+    
+    results = {}
+    stale_files = []
+    stats = {}
+    for pgn_file in pgn_files:
+        stat = stats[pgn_file] = os.stat(pgn_file)
+        entry = manifest.get(pgn_file)
+        if (entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+                and os.path.exists(_parsed_cache_path(pgn_file))):
+            results[pgn_file] = (_load_parsed(pgn_file), entry['games'])
+        else:
+            stale_files.append(pgn_file)
+    print(f"Loaded {len(results)} PGN files from cache, parsing {len(stale_files)}")
+    
+    # Parsing is pure Python and CPU-bound, so spread the files across processes
+    if stale_files:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for pgn_file, (parsed, game_count) in zip(stale_files, executor.map(_parse_one, stale_files)):
+                results[pgn_file] = (parsed, game_count)
+                _save_parsed(pgn_file, parsed)
+                stat = stats[pgn_file]
+                manifest[pgn_file] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'games': game_count}
+        
+        manifest = {path: entry for path, entry in manifest.items() if path in results}
+        with open(PGN_MANIFEST_PATH, 'w') as f:
+            json.dump({'parser_version': PGN_PARSER_VERSION, 'files': manifest}, f, indent=2)
     
+    # Deduplicate in file order so the kept copy of a game does not depend on the cache
     for pgn_file in pgn_files:
-        print(f"Processing {pgn_file}...")
-        # Try different encodings
-        for encoding in ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']:
-            try:
-                with open(pgn_file, 'r', encoding=encoding) as f:
-                    content = f.read()
-                    games = content.split('\n\n[')  # Split into individual games
-                    game_count = 0
-                    batch_size = 100  # Process 100 games at a time
-                    
-                    for game in games:
-                        if not game.strip():
-                            continue
-                            
-                        game_count += 1
-                        if game_count % batch_size == 0:
-                            print(f"Processed {game_count} games from {pgn_file}")
-                            
-                        if not game.startswith('['):
-                            game = '[' + game
-                        
-                        # Parse the PGN game
-                        pgn = io.StringIO(game)
-                        try:
-                            chess_game = chess.pgn.read_game(pgn)
-                            if chess_game is None:
-                                continue
-                            
-                            # Extract relevant information
-                            headers = dict(chess_game.headers)
-                            moves = ' '.join(move.uci() for move in chess_game.mainline_moves())
-                            
-                            # Create a richer description combining headers and moves
-                            description = (
-                                f"Event: {headers.get('Event', 'Unknown')} "
-                                f"Site: {headers.get('Site', 'Unknown')} "
-                                f"Date: {headers.get('Date', 'Unknown')} "
-                                f"White: {headers.get('White', 'Unknown')} "
-                                f"Black: {headers.get('Black', 'Unknown')} "
-                                f"Result: {headers.get('Result', 'Unknown')} "
-                                f"ECO: {headers.get('ECO', 'Unknown')} "
-                                f"Moves: {moves}"
-                            )
-                            
-                            documents.append({
-                                'description': description,
-                                'source': os.path.basename(pgn_file)
-                            })
-                        except Exception as e:
-                            print(f"Error parsing game in {pgn_file}: {str(e)}")
-                            continue
-                            
-                    total_games += game_count
-                    print(f"Successfully processed {game_count} games from {pgn_file} with {encoding} encoding")
-                    break
-                    
-            except UnicodeDecodeError:
-                if encoding == 'cp1252':  # Last encoding we try
-                    print(f"Failed to read {pgn_file} with any encoding")
+        file_documents, game_count = results[pgn_file]
+        total_games += game_count
+        for game_key, document in file_documents:
+            if game_key in seen_games:
+                duplicate_games += 1
                 continue
-                    
+            seen_games.add(game_key)
+            documents.append(document)
+
     print(f"Total games processed across all files: {total_games}")
+    print(f"Skipped {duplicate_games} duplicate games")
     print(f"Total documents created: {len(documents)}")
     return documents
 
-def chunk_documents(documents: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    chunked_documents = []
-    # Add deduplication to avoid nearly identical chunks
-    seen_chunks = set()
+def iter_unique_chunks(documents: Iterable[Game]) -> Iterator[Chunk]:
+    """Chunk documents and drop duplicate chunks, yielding them one at a time so
+    embedding can start before chunking has finished"""
+    # Add deduplication to avoid nearly identical chunks; keep digests rather
+    # than the chunk strings themselves
+    seen_hashes = set()
+    document_count = 0
     
     for doc in documents:
-        chunks = chunk_text(doc['description'])
-        for chunk in chunks:
+        document_count += 1
+        for chunk in chunk_text(doc.description):
             # Only add chunk if it's sufficiently different
             chunk_normalized = ' '.join(chunk.split())  # Remove extra whitespace
-            if chunk_normalized not in seen_chunks:
-                seen_chunks.add(chunk_normalized)
-                chunked_documents.append({
-                    'description': chunk,
-                    'source': doc['source']
-                })
-    print(f"Reduced to {len(chunked_documents)} unique chunks from {len(documents)} documents")
-    return chunked_documents
-
-def create_embeddings(docs: List[Dict[str, str]]):
-    embeddings = []
-    total = len(docs)
-    
-    print(f"Creating embeddings for {total} documents...")
-    for i, doc in enumerate(docs, 1):
-        if i % 100 == 0:  # Show progress every 100 documents
-            print(f"Processing document {i}/{total}")
+            chunk_hash = content_hash(chunk_normalized)
+            if chunk_hash not in seen_hashes:
+                seen_hashes.add(chunk_hash)
+                yield Chunk(chunk, doc.source, chunk_hash)
+    print(f"Reduced to {len(seen_hashes)} unique chunks from {document_count} documents")
+
+def estimate_tokens(text: str) -> float:
+    """Estimate token count from word count"""
+    return len(text.split()) / WORDS_PER_TOKEN
+
+def batch_documents(docs: List[Chunk], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[Tuple[int, List[Chunk]]]:
+    """Group documents into (offset, batch) pairs that respect both the input count
+    and the estimated token budget of a single embeddings request"""
+    batches = []
+    start = 0
+    tokens = 0
+    for i, doc in enumerate(docs):
+        doc_tokens = estimate_tokens(doc.description)
+        if i > start and (i - start >= batch_size or tokens + doc_tokens > MAX_TOKENS_PER_REQUEST):
+            batches.append((start, docs[start:i]))
+            start = i
+            tokens = 0
+        tokens += doc_tokens
+    if start < len(docs):
+        batches.append((start, docs[start:]))
+    return batches
+
+@openai_retry
+async def embed_batch(texts: List[str]):
+    """Embed one batch of texts, retrying transient API errors with backoff"""
+    response = await client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts
+    )
+    return response.data
+
+def fill_from_cache(docs: List[Chunk], rows: list, start: int, cache: EmbeddingCache = None) -> Tuple[List[bytes], List[int]]:
+    """Reuse embeddings of unchanged chunks from previous runs: fills rows[start + i]
+    for every cached doc. Returns the docs' text hashes and the rows still to embed."""
+    hashes = [text_hash(doc.description) for doc in docs]
+    cached = cache.get_many(EMBEDDING_MODEL, hashes) if cache else {}
+    missing = []
+    for i, h in enumerate(hashes):
+        if h in cached:
+            rows[start + i] = cached[h]
+        else:
+            missing.append(start + i)
+    return hashes, missing
+
+async def create_embeddings(chunks: Iterable[Chunk], batch_size: int = EMBEDDING_BATCH_SIZE, concurrency: int = EMBEDDING_CONCURRENCY, cache: EmbeddingCache = None) -> Tuple[np.ndarray, List[Chunk]]:
+    """Embed a stream of chunks, pulling batch_size chunks at a time so requests
+    are in flight while later chunks are still being produced.
+    Returns the embeddings and the chunks in matching row order."""
+    documents = []
+    rows = []
+    text_hashes = []
+    cached_count = 0
+    done = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+    
+    async def run_batch(batch_rows, batch):
+        nonlocal done
+        try:
+            data = await embed_batch([doc.description for doc in batch])
+        finally:
+            semaphore.release()
+        # Each item carries its position within the batch
+        new_vectors = []
+        for item in data:
+            row = batch_rows[item.index]
+            rows[row] = np.asarray(item.embedding, dtype=np.float32)
+            new_vectors.append((text_hashes[row], rows[row]))
+        if cache:
+            cache.put_many(EMBEDDING_MODEL, new_vectors)
+        done += len(batch)
+        print(f"Processed document {done}")
+    
+    print("Creating embeddings...")
+    iterator = iter(chunks)
+    while group := list(itertools.islice(iterator, batch_size)):
+        start = len(documents)
+        documents.extend(group)
+        rows.extend([None] * len(group))
+        
+        hashes, missing = fill_from_cache(group, rows, start, cache)
+        text_hashes.extend(hashes)
+        cached_count += len(group) - len(missing)
+        
+        # Waiting for a free slot here keeps chunking from running far ahead
+        for offset, batch in batch_documents([documents[row] for row in missing], batch_size):
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(run_batch(missing[offset:offset + len(batch)], batch)))
+    
+    await asyncio.gather(*tasks)
+    print(f"Embedded {len(documents)} chunks ({cached_count} from cache)")
+    embeddings = np.stack(rows) if rows else None
+    return embeddings, documents
+
+def split_batches(requests: List[dict]) -> Iterator[List[dict]]:
+    """Group embedding requests into batches within the Batch API's input and file size limits"""
+    group, inputs, size = [], 0, 0
+    for request in requests:
+        texts = request["body"]["input"]
+        request_size = sum(len(text.encode('utf-8')) for text in texts) + 200
+        if group and (inputs + len(texts) > BATCH_MAX_INPUTS or size + request_size > BATCH_MAX_BYTES):
+            yield group
+            group, inputs, size = [], 0, 0
+        group.append(request)
+        inputs += len(texts)
+        size += request_size
+    if group:
+        yield group
+
+def create_embeddings_batch(chunks: Iterable[Chunk], batch_size: int = EMBEDDING_BATCH_SIZE, cache: EmbeddingCache = None) -> Tuple[np.ndarray, List[Chunk]]:
+    """Embed chunks through the OpenAI Batch API: half the price of the live
+    endpoint, results within 24h. Suited to offline indexing.
+    Returns the embeddings and the chunks in matching row order."""
+    documents = list(chunks)
+    rows = [None] * len(documents)
+    hashes, missing = fill_from_cache(documents, rows, 0, cache)
+    print(f"Found {len(documents) - len(missing)} cached embeddings")
+    
+    if missing:
+        # One batch line per micro-batch of inputs, keyed by its offset into missing
+        requests = [
+            {
+                "custom_id": str(offset),
+                "body": {"model": EMBEDDING_MODEL, "input": [doc.description for doc in batch]}
+            }
+            for offset, batch in batch_documents([documents[i] for i in missing], batch_size)
+        ]
+        batches = list(split_batches(requests))
+        print(f"Submitting {len(missing)} documents in {len(requests)} requests across {len(batches)} batches...")
+        
+        # Batches run one after another: queued batch tokens count against an
+        # organization-wide limit, and each finished batch is cached before the next
+        for batch_number, batch_requests in enumerate(batches, 1):
+            print(f"Running batch {batch_number}/{len(batches)}")
+            results = run_batch(batch_client, batch_requests, "/v1/embeddings")
             
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=doc['description']
-        )
-        embeddings.append(response.data[0].embedding)
-    return np.array(embeddings)
-
-def create_faiss_index(embeddings: np.ndarray):
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
+            new_vectors = []
+            for custom_id, body in results.items():
+                offset = int(custom_id)
+                for item in body['data']:
+                    row = missing[offset + item['index']]
+                    rows[row] = np.asarray(item['embedding'], dtype=np.float32)
+                    new_vectors.append((hashes[row], rows[row]))
+            if cache:
+                cache.put_many(EMBEDDING_MODEL, new_vectors)
+        
+        unfinished = sum(row is None for row in rows)
+        if unfinished:
+            # Finished vectors are cached, so a rerun only resubmits these
+            raise RuntimeError(f"{unfinished} documents were not embedded by the batch; rerun to retry them")
+    
+    embeddings = np.stack(rows) if rows else None
+    return embeddings, documents
+
+def create_faiss_index(embeddings: np.ndarray, index_type: str = "auto"):
+    """Build an inner-product FAISS index over L2-normalized embeddings, so search
+    scores are cosine similarities. "auto" uses an exact flat index for small
+    corpora and HNSW above FLAT_INDEX_MAX vectors; "ivfpq" trades some recall for
+    a much smaller index. Returns the index and the type actually built.
+    Normalizes embeddings in place."""
+    n, dimension = embeddings.shape
+    faiss.normalize_L2(embeddings)
+    if index_type == "auto":
+        index_type = "flat" if n < FLAT_INDEX_MAX else "hnsw"
+    
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "ivfpq":
+        nlist = max(1, int(4 * math.sqrt(n)))
+        # k-means training needs at least as many vectors as centroids: nlist for
+        # the coarse quantizer and 2**PQ_NBITS per sub-quantizer
+        min_vectors = max(nlist, 2 ** PQ_NBITS)
+        if n < min_vectors or dimension % PQ_M != 0:
+            print(f"Warning: cannot train an ivfpq index on {n} vectors of dimension {dimension} "
+                  f"(needs at least {min_vectors} vectors and a dimension divisible by {PQ_M}); "
+                  f"building a flat index instead")
+            return create_faiss_index(embeddings, "flat")
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    
     index.add(embeddings)
-    return index
+    return index, index_type
+
+def save_documents(processed_documents, index_id):
+    """Write chunk texts as one UTF-8 blob plus an offsets array, and sources as
+    small integer codes, so search can memory-map them instead of unpickling.
+    Returns the file paths and the source names the codes refer to."""
+    text_path = f'embeddings/docs_text_{index_id}.bin'
+    offsets_path = f'embeddings/docs_offsets_{index_id}.npy'
+    sources_path = f'embeddings/sources_{index_id}.npy'
+    
+    source_names = sorted({doc.source for doc in processed_documents})
+    source_codes = {name: code for code, name in enumerate(source_names)}
+    
+    offsets = np.empty(len(processed_documents) + 1, dtype=np.int64)
+    offsets[0] = 0
+    with open(text_path, 'wb') as f:
+        position = 0
+        for i, doc in enumerate(processed_documents):
+            data = doc.description.encode('utf-8')
+            f.write(data)
+            position += len(data)
+            offsets[i + 1] = position
+    np.save(offsets_path, offsets)
+    np.save(sources_path, np.array([source_codes[doc.source] for doc in processed_documents], dtype=np.int32))
+    
+    files = {
+        "documents_text": text_path,
+        "documents_offsets": offsets_path,
+        "documents_sources": sources_path
+    }
+    return files, source_names
 
-def save_metadata(embedding_model, index_id):
+def save_metadata(embedding_model, index_id, index_type, files, sources):
     """Save metadata with consistent filename format"""
     metadata = {
         "dataset_id": index_id,  # Add dataset_id field
         "embedding_model": embedding_model,
         "index_id": index_id,
         "creation_date": datetime.now().isoformat(),
+        "index_type": index_type,  # Tells search which tuning knobs apply
+        "metric": "ip",  # Cosine similarity over normalized vectors; older indexes are L2
         # Add file paths to help with loading
-        "files": {
-            "embeddings": f"embeddings/embeddings_{index_id}.pkl",
-            "index": f"embeddings/index_{index_id}.bin",
-            "documents": f"embeddings/processed_documents_{index_id}.pkl"
-        }
+        "files": files,
+        "sources": sources  # Names for the integer codes in documents_sources
     }
     
     # Use consistent metadata filename format
@@ -175,16 +480,18 @@ def save_metadata(embedding_model, index_id):
         json.dump(metadata, f, indent=2)
     print(f"Saved metadata to {metadata_path}")
 
-def save_embeddings_and_index(embeddings, index, processed_documents, embedding_model):
+def save_embeddings_and_index(embeddings, index, processed_documents, embedding_model, index_type):
     """Save embeddings, index, and documents with consistent naming"""
     os.makedirs('embeddings', exist_ok=True)
     index_id = str(uuid.uuid4())
     
-    # Save embeddings
-    embeddings_path = f'embeddings/embeddings_{index_id}.pkl'
-    with open(embeddings_path, 'wb') as f:
-        pickle.dump(embeddings, f)
-    print(f"Saved embeddings to {embeddings_path}")
+    # Save embeddings; a flat index already holds the exact vectors
+    # (index.reconstruct_n), so only approximate indexes get a copy
+    embeddings_path = None
+    if index_type != "flat":
+        embeddings_path = f'embeddings/embeddings_{index_id}.npy'
+        np.save(embeddings_path, embeddings)
+        print(f"Saved embeddings to {embeddings_path}")
     
     # Save index
     index_path = f'embeddings/index_{index_id}.bin'
@@ -192,18 +499,35 @@ def save_embeddings_and_index(embeddings, index, processed_documents, embedding_
     print(f"Saved index to {index_path}")
     
     # Save processed documents
-    documents_path = f'embeddings/processed_documents_{index_id}.pkl'
-    with open(documents_path, 'wb') as f:
-        pickle.dump(processed_documents, f)
-    print(f"Saved processed documents to {documents_path}")
+    document_files, sources = save_documents(processed_documents, index_id)
+    print(f"Saved processed documents to {document_files['documents_text']}")
     
     # Save metadata
-    save_metadata(embedding_model, index_id)
+    files = {
+        "embeddings": embeddings_path,  # None when the index stores the vectors itself
+        "index": index_path,
+        **document_files
+    }
+    save_metadata(embedding_model, index_id, index_type, files, sources)
     
     print(f"All files saved successfully with index ID: {index_id}")
     return index_id
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the chess game embeddings index")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE,
+                        help="Inputs per embeddings request")
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_CONCURRENCY,
+                        help="Embeddings requests in flight at once")
+    parser.add_argument("--batch", action="store_true",
+                        help="Embed through the OpenAI Batch API (50%% cheaper, results within 24h)")
+    parser.add_argument("--index-type", choices=["auto", "flat", "hnsw", "ivfpq"], default="auto",
+                        help="FAISS index type; auto picks flat or hnsw by corpus size")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
     # Load and process documents
     print("Loading PGN files...")
     documents = load_pgn_files()
@@ -214,26 +538,40 @@ def main():
     
     print(f"Loaded {len(documents)} games")
     
-    # Process documents with chunking
-    processed_documents = chunk_documents(documents)
-    print(f"Created {len(processed_documents)} chunks")
-    
-    # Create embeddings
+    # Chunk, deduplicate and embed in one streaming pass
     print(f"Creating embeddings using {EMBEDDING_MODEL}...")
-    embeddings = create_embeddings(processed_documents)
+    cache = EmbeddingCache()
+    try:
+        if args.batch:
+            embeddings, processed_documents = create_embeddings_batch(
+                iter_unique_chunks(documents),
+                batch_size=args.batch_size,
+                cache=cache
+            )
+        else:
+            embeddings, processed_documents = asyncio.run(create_embeddings(
+                iter_unique_chunks(documents),
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                cache=cache
+            ))
+    finally:
+        cache.close()
+    print(f"Created {len(processed_documents)} chunks")
     print("Embeddings created successfully!")
     
     # Create FAISS index
     print("Creating index...")
-    faiss_index = create_faiss_index(embeddings)
-    print("Index created successfully!")
+    faiss_index, index_type = create_faiss_index(embeddings, args.index_type)
+    print(f"Index ({index_type}) created successfully!")
     
     # Save everything
     index_id = save_embeddings_and_index(
         embeddings,
         faiss_index,
         processed_documents,
-        EMBEDDING_MODEL
+        EMBEDDING_MODEL,
+        index_type
     )
     
     return index_id
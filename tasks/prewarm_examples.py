@@ -0,0 +1,70 @@
+from dotenv import load_dotenv
+from openai import OpenAI
+import json
+import os
+from utils.openai_batch import run_batch
+from utils.query import (
+    EXAMPLE_QUERIES,
+    EXAMPLE_CACHE_PATH,
+    build_format_request,
+    build_summary_request,
+    current_index_id,
+    format_result,
+    retrieve_games,
+)
+
+# Load environment variables and set up OpenAI client
+load_dotenv()
+client = OpenAI()
+
+# Must match num_results used by the Player Analysis page
+NUM_RESULTS = 3
+CHAT_ENDPOINT = "/v1/chat/completions"
+
+def prewarm_examples(queries, num_results: int = NUM_RESULTS):
+    """Answer the example queries through the Batch API (50% cheaper than live calls).
+    Runs two batches: one formatting every retrieved game, one summarizing per query."""
+    # Retrieval is local (FAISS), only the LLM calls go through the batch
+    matches = {}
+    for q_idx, query in enumerate(queries):
+        print(f"Retrieving games for: {query}")
+        matches[q_idx] = retrieve_games(query, num_results=num_results)
+
+    format_requests = [
+        {"custom_id": f"q{q_idx}-g{rank}", "body": build_format_request(document)}
+        for q_idx, hits in matches.items()
+        for rank, (_, document) in enumerate(hits, 1)
+    ]
+    print(f"Formatting {len(format_requests)} games...")
+    formatted = run_batch(client, format_requests, CHAT_ENDPOINT)
+
+    summary_requests = []
+    for q_idx, hits in matches.items():
+        results = []
+        for rank, (similarity, _) in enumerate(hits, 1):
+            body = formatted.get(f"q{q_idx}-g{rank}")
+            if body is None:
+                continue
+            results.append(format_result(rank, similarity, body["choices"][0]["message"]["content"]))
+        summary_requests.append({"custom_id": f"q{q_idx}", "body": build_summary_request(queries[q_idx], results)})
+    print(f"Summarizing {len(summary_requests)} queries...")
+    summaries = run_batch(client, summary_requests, CHAT_ENDPOINT)
+
+    return {
+        queries[q_idx]: summaries[f"q{q_idx}"]["choices"][0]["message"]["content"]
+        for q_idx in matches
+        if f"q{q_idx}" in summaries
+    }
+
+def main():
+    # Answers are only valid for the index they were retrieved from
+    index_id = current_index_id()
+    cache = prewarm_examples(EXAMPLE_QUERIES)
+
+    os.makedirs(os.path.dirname(EXAMPLE_CACHE_PATH), exist_ok=True)
+    with open(EXAMPLE_CACHE_PATH, 'w', encoding='utf-8') as f:
+        json.dump({"index_id": index_id, "answers": cache}, f, indent=2)
+    print(f"Saved {len(cache)}/{len(EXAMPLE_QUERIES)} example answers for index {index_id} to {EXAMPLE_CACHE_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+CACHE_PATH = 'embeddings/embedding_cache.sqlite'
+SQLITE_MAX_VARIABLES = 900  # stay under SQLite's default bound-parameter limit
+
+def text_hash(text: str) -> bytes:
+    """Content key for a text; identical texts share cached embeddings"""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+class EmbeddingCache:
+    """On-disk cache of embedding vectors keyed by (model, sha256(text)).
+    Vectors are stored as raw float32 bytes so reads and writes are a plain copy."""
+
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb ("
+            "model TEXT NOT NULL, hash BLOB NOT NULL, vec BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self.conn.commit()
+
+    def get_many(self, model: str, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return the cached vectors for whichever hashes are present"""
+        found = {}
+        unique = list(set(hashes))
+        for start in range(0, len(unique), SQLITE_MAX_VARIABLES):
+            chunk = unique[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT hash, vec FROM emb WHERE model = ? AND hash IN ({placeholders})",
+                [model, *chunk]
+            )
+            for h, vec in rows:
+                found[h] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[bytes, np.ndarray]]):
+        """Store new vectors; existing entries are left untouched"""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO emb (model, hash, vec) VALUES (?, ?, ?)",
+            ((model, h, np.asarray(vec, dtype=np.float32).tobytes()) for h, vec in items)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
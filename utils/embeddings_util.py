@@ -2,27 +2,77 @@ import streamlit as st
 import os
 import json
 import faiss
+import numpy as np
 import pickle
+import mmap
 from typing import List, Dict, Tuple, Any
 
+class DocumentStore:
+    """Read-only view of saved chunk texts. The text blob and offsets are memory
+    mapped, so opening is O(1) and store[i] decodes only the i-th chunk."""
+
+    def __init__(self, text_path: str, offsets_path: str, sources_path: str = None, source_names: List[str] = None):
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        with open(text_path, 'rb') as f:
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.source_codes = np.load(sources_path, mmap_mode='r') if sources_path else None
+        self.source_names = source_names or []
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> str:
+        i = int(i)
+        if not 0 <= i < len(self):
+            raise IndexError(f"document index {i} out of range")
+        return self._text[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def source(self, i) -> str:
+        """Name of the PGN file the i-th chunk came from"""
+        return self.source_names[self.source_codes[int(i)]]
+
 def load_all_metadata() -> List[Dict[str, Any]]:
+    """Metadata of every saved index, newest first.
+    Matches metadata_{id}.json as written by tasks/create_index.py and the older {id}_metadata.json."""
     all_metadata = []
     for file in os.listdir('embeddings'):
-        if file.endswith("_metadata.json"):
+        if (file.startswith("metadata_") or file.endswith("_metadata.json")) and file.endswith(".json"):
             with open(os.path.join('embeddings', file), 'r') as f:
                 metadata = json.load(f)
                 all_metadata.append(metadata)
+    all_metadata.sort(key=lambda m: m.get('creation_date', ''), reverse=True)
     return all_metadata
 
 def load_embeddings_and_index(metadata: Dict[str, Any]) -> Tuple[Any, Any, Any, str]:
+    """Load a saved index. Embeddings are memory-mapped from .npy when saved, read
+    from the legacy pickle otherwise, and None for flat indexes saved without a
+    copy (use index.reconstruct_n(0, index.ntotal) if the vectors are needed)."""
     try:
         dataset_id = metadata['dataset_id']
         index_id = metadata['index_id']
-        with open(f'embeddings/{dataset_id}_{index_id}_embeddings.pkl', 'rb') as f:
-            embeddings = pickle.load(f)
-        index = faiss.read_index(f'embeddings/{dataset_id}_{index_id}_index.bin')
-        with open(f'embeddings/{dataset_id}_{index_id}_processed_documents.pkl', 'rb') as f:
-            processed_documents = pickle.load(f)
+        files = metadata.get('files') or {
+            "embeddings": f'embeddings/{dataset_id}_{index_id}_embeddings.pkl',
+            "index": f'embeddings/{dataset_id}_{index_id}_index.bin',
+            "documents": f'embeddings/{dataset_id}_{index_id}_processed_documents.pkl'
+        }
+        embeddings = None
+        embeddings_path = files.get('embeddings')
+        if embeddings_path and embeddings_path.endswith('.npy'):
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+        elif embeddings_path:
+            with open(embeddings_path, 'rb') as f:
+                embeddings = pickle.load(f)
+        index = faiss.read_index(files['index'])
+        if 'documents_text' in files:
+            processed_documents = DocumentStore(
+                files['documents_text'],
+                files['documents_offsets'],
+                files.get('documents_sources'),
+                metadata.get('sources')
+            )
+        else:
+            with open(files['documents'], 'rb') as f:
+                processed_documents = pickle.load(f)
         return embeddings, index, processed_documents, metadata['embedding_model']
     except FileNotFoundError:
         st.error(f"Embeddings or index not found for dataset {dataset_id} and index {index_id}.")
@@ -49,7 +99,7 @@ def select_embedding_index() -> Tuple[Dict[str, Any], Any, Any, Any, str]:
     
     embeddings, index, processed_documents, embedding_model = load_embeddings_and_index(selected_metadata)
     
-    if embeddings is not None and index is not None and processed_documents is not None and embedding_model is not None:
+    if index is not None and processed_documents is not None and embedding_model is not None:
         st.info(f"Using embedding model: {embedding_model}")
     else:
         st.warning(f"Failed to load embeddings for the selected set. Please try another or run the Create Embeddings Index script again.")
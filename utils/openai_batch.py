@@ -0,0 +1,57 @@
+import io
+import json
+import time
+from typing import Any, Dict, List
+
+from openai import OpenAI
+
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def run_batch(client: OpenAI, requests: List[Dict[str, Any]], endpoint: str, poll_interval: int = 30) -> Dict[str, Dict[str, Any]]:
+    """Run requests through the OpenAI Batch API and wait for the results
+    Args:
+        client: OpenAI client
+        requests: List of {"custom_id": ..., "body": ...} entries
+        endpoint: API endpoint for every request, e.g. "/v1/chat/completions"
+        poll_interval: Seconds to wait between status checks
+    Returns:
+        Mapping of custom_id to response body for every successful request
+    """
+    lines = [
+        json.dumps({"custom_id": r["custom_id"], "method": "POST", "url": endpoint, "body": r["body"]})
+        for r in requests
+    ]
+    payload = io.BytesIO(("\n".join(lines) + "\n").encode('utf-8'))
+    input_file = client.files.create(file=("batch_input.jsonl", payload), purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=endpoint,
+        completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+    while batch.status not in FINAL_BATCH_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if counts:
+            print(f"Batch {batch.id}: {batch.status} ({counts.completed}/{counts.total} done)")
+
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
+    results = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                continue
+            results[item["custom_id"]] = response["body"]
+    failed = len(requests) - len(results)
+    if failed:
+        print(f"Warning: {failed} batch requests failed")
+    return results
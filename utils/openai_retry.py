@@ -0,0 +1,51 @@
+from typing import Optional
+
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from tenacity.wait import wait_base
+
+# Transient failures worth retrying; other API errors (bad request, auth) are not
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+MAX_RETRY_AFTER = 60  # seconds; never wait longer than this on a server hint
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Delay requested by the server via retry-after-ms / retry-after, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except ValueError:
+        # retry-after may also be an HTTP date; fall back to backoff
+        return None
+    return None
+
+class wait_retry_after(wait_base):
+    """Wait at least as long as the server asked for, otherwise use the fallback backoff"""
+
+    def __init__(self, fallback: wait_base):
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        delay = self.fallback(retry_state)
+        retry_after = _retry_after_seconds(retry_state.outcome.exception())
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+        return delay
+
+# Decorator for sync or async functions that call the OpenAI API
+openai_retry = retry(
+    stop=stop_after_attempt(6),
+    wait=wait_retry_after(wait_exponential_jitter(initial=1, max=60)),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
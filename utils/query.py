@@ -1,129 +1,321 @@
 import pandas as pd
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 from datetime import datetime
 import argparse
 import os
-from openai import OpenAI
+import json
+import asyncio
+import atexit
+import threading
+from cachetools import LRUCache, cached
+import faiss
+from openai import AsyncOpenAI, OpenAI
 from utils.embeddings_util import load_all_metadata, load_embeddings_and_index
+from utils.openai_retry import openai_retry
 from dotenv import load_dotenv
-from typing import Union
+from typing import Any, Dict, List, Tuple, Union
 
 # Load environment variables
 load_dotenv()
 
-def format_game_with_llm(game_text: str, client: OpenAI) -> str:
-    """Use OpenAI to format and analyze a chess game"""
-    model = os.getenv('MODEL', 'gpt-3.5-turbo')  # Fallback to gpt-3.5-turbo if not specified
-    
-    prompt = """
-    Analyze and format this chess game. Extract key information and provide:
+# FAISS searches are OpenMP-parallel; use every core
+faiss.omp_set_num_threads(os.cpu_count())
+
+# Static game analysis rubric; kept identical across calls so OpenAI can cache it
+try:
+    with open('prompt/game_analysis.md', 'r', encoding='utf-8') as file:
+        GAME_ANALYSIS_PROMPT = file.read()
+except OSError:
+    GAME_ANALYSIS_PROMPT = """You are a chess expert analyzing games. Analyze and format the chess game you are given. Extract key information and provide:
     1. Basic game details (Event, Date, Players, Result, ECO)
     2. A brief description of the game's key moments or strategic themes
-    3. Format the output in a clear, readable way
-    
-    Chess game:
-    {game_text}
-    """.format(game_text=game_text)
-
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a chess expert analyzing games."},
-            {"role": "user", "content": prompt}
+    3. Format the output in a clear, readable way"""
+
+# Search-time knobs for approximate FAISS indexes (see tasks/create_index.py)
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+
+# Example queries offered in the Player Analysis sidebar; answers can be
+# precomputed offline with tasks/prewarm_examples.py
+EXAMPLE_QUERIES = [
+    "Show me Shabalov's best games as White",
+    "What are some interesting games from the World Senior Championships?",
+    "Find games with brilliant tactical combinations",
+    "Show games where underdogs defeated higher-rated players",
+    "What are some notable games in the Sicilian Defense?",
+]
+EXAMPLE_CACHE_PATH = 'embeddings/example_cache.json'
+
+def load_example_cache(index_id: str) -> Dict[str, str]:
+    """Load precomputed example query answers, or an empty dict if none exist
+    or they were computed against a different index than index_id"""
+    if index_id is None or not os.path.exists(EXAMPLE_CACHE_PATH):
+        return {}
+    with open(EXAMPLE_CACHE_PATH, 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    if cache.get('index_id') != index_id:
+        return {}
+    return cache['answers']
+
+def build_format_request(game_text: str) -> Dict[str, Any]:
+    """Chat completion parameters for formatting and analyzing a single game.
+    Only the game text varies, so the long system prompt stays cacheable."""
+    model = os.getenv('MODEL', 'gpt-4o-mini')  # Fallback to gpt-4o-mini if not specified
+
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": GAME_ANALYSIS_PROMPT},
+            {"role": "user", "content": f"Chess game:\n{game_text}"}
         ],
-        temperature=0.3,
-        max_tokens=500
-    )
+        "temperature": 0.3,
+        "max_tokens": 400,
+        "stop": ["\n\n\n"]
+    }
+
+def build_summary_request(query: str, results: List[str]) -> Dict[str, Any]:
+    """Chat completion parameters for the conversational summary of search results"""
+    combined_results = "\n\n".join(results)
+    summary_prompt = f"""
+    Based on these chess games:
+    {combined_results}
     
+    Provide a concise, conversational response that:
+    1. Summarizes the key findings
+    2. Highlights interesting patterns or insights
+    3. Uses a friendly, engaging tone
+    4. Keeps the response focused and relevant to the original query: "{query}"
+    """
+    
+    return {
+        "model": os.getenv('MODEL', 'gpt-4o-mini'),
+        "messages": [
+            {"role": "system", "content": "You are a helpful chess analysis assistant providing insights about games."},
+            {"role": "user", "content": summary_prompt}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 400,
+        "stop": ["\n\n\n"]
+    }
+
+@openai_retry
+def summarize_results(query: str, results: List[str], client: OpenAI) -> str:
+    """Use OpenAI to write a conversational answer from the formatted results"""
+    response = client.chat.completions.create(**build_summary_request(query, results))
     return response.choices[0].message.content
 
-def search_games(query: str, client: OpenAI = None, num_results: int = 5, dataset_id: str = None, return_str: bool = False) -> Union[None, str]:
-    """Search chess games using semantic search and analyze with OpenAI
-    Args:
-        query: Search query string
-        client: OpenAI client (optional - will create new one if None)
-        num_results: Number of results to return
-        dataset_id: Specific dataset to search
-        return_str: If True, returns formatted string for web UI, else prints to console
-    """
-    # Initialize OpenAI client if not provided (CLI usage)
-    if client is None:
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        if not client.api_key:
-            msg = "Error: OPENAI_API_KEY environment variable not set"
-            return msg if return_str else print(msg)
+def format_result(rank: int, similarity: float, formatted_game: str) -> str:
+    """Render one formatted search hit"""
+    return f"Game {rank} (similarity: {similarity:.2f})\n{formatted_game}"
+
+@openai_retry
+async def format_game_with_llm(game_text: str, client: AsyncOpenAI) -> str:
+    """Use OpenAI to format and analyze a chess game"""
+    response = await client.chat.completions.create(**build_format_request(game_text))
+    return response.choices[0].message.content
+
+async def _format_all(documents: List[Any], client: OpenAI) -> List[str]:
+    """Format all games concurrently. The async client is opened per call because
+    it is bound to the event loop that asyncio.run creates."""
+    async with AsyncOpenAI(api_key=client.api_key, base_url=client.base_url) as async_client:
+        return await asyncio.gather(*(format_game_with_llm(doc, async_client) for doc in documents))
+
+# Bounded, thread-safe caches: the web UI serves many sessions from one process
+# and each SentenceTransformer takes several hundred MB
+_model_cache = LRUCache(maxsize=2)
+_query_cache = LRUCache(maxsize=1024)
+ENCODE_BATCH_SIZE = 64
+
+@cached(_model_cache, lock=threading.Lock(), info=True)
+def _get_model(model_name: str) -> SentenceTransformer:
+    """Load a SentenceTransformer once per process, in fp16 on GPU when available"""
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SentenceTransformer(model_name, device=device)
+    if model.device.type == 'cuda':
+        model.half()
+    return model
+
+def encode_queries(model_name: str, queries: List[str]) -> np.ndarray:
+    """Embed many texts in batches; returns a float32 (len(queries), dim) array"""
+    with torch.inference_mode():
+        embeddings = _get_model(model_name).encode(
+            queries,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+    return embeddings.astype(np.float32, copy=False)
+
+@cached(_query_cache, lock=threading.Lock(), info=True)
+def _encode_query(model_name: str, query: str) -> np.ndarray:
+    """Embed a query string; identical queries are served from memory"""
+    return encode_queries(model_name, [query])[0]
+
+@atexit.register
+def _log_cache_stats():
+    """Report hit rates so the cache sizes can be tuned"""
+    print(f"Model cache: {_get_model.cache_info()}")
+    print(f"Query embedding cache: {_encode_query.cache_info()}")
 
+def _select_metadata(dataset_id: str = None) -> Dict[str, Any]:
+    """Metadata of the dataset a search would use: dataset_id if given, else the newest
+    Raises:
+        ValueError: If no matching dataset exists; the message is user-facing
+    """
     # Load metadata - add debug logging
     all_metadata = load_all_metadata()
     if not all_metadata:
         # Add more specific error message
-        msg = "No metadata found in embeddings directory. Files found: " + str(os.listdir('embeddings'))
-        return msg if return_str else print(msg)
+        raise ValueError("No metadata found in embeddings directory. Files found: " + str(os.listdir('embeddings')))
     
     # Use specified dataset or first available - add debug logging
     metadata = next((m for m in all_metadata if m['dataset_id'] == dataset_id), all_metadata[0] if all_metadata else None)
     if not metadata:
-        msg = f"No dataset found matching ID: {dataset_id}. Available datasets: {[m.get('dataset_id') for m in all_metadata]}"
-        return msg if return_str else print(msg)
+        raise ValueError(f"No dataset found matching ID: {dataset_id}. Available datasets: {[m.get('dataset_id') for m in all_metadata]}")
+    return metadata
+
+def current_index_id(dataset_id: str = None) -> Union[str, None]:
+    """index_id of the dataset a search would use, or None if there is none"""
+    try:
+        return _select_metadata(dataset_id)['index_id']
+    except (ValueError, OSError):
+        return None
+
+def _load_search_dataset(dataset_id: str = None, verbose: bool = False) -> Tuple[Dict[str, Any], Any, Any, str]:
+    """Load and tune the index for a dataset
+    Returns:
+        (metadata, index, processed_documents, embedding model name)
+    Raises:
+        ValueError: If no dataset can be loaded; the message is user-facing
+    """
+    metadata = _select_metadata(dataset_id)
     
     # Load embeddings and index - add debug logging
     try:
         embeddings, index, processed_documents, model_name = load_embeddings_and_index(metadata)
-        if not all([embeddings, index, processed_documents, model_name]):
-            msg = f"Failed to load embeddings for dataset {metadata.get('dataset_id')}. Please check the embeddings directory and file paths in metadata."
-            return msg if return_str else print(msg)
+        # Embeddings may legitimately be absent; search only needs the index
+        loaded = index is not None and processed_documents is not None and bool(model_name)
     except Exception as e:
-        msg = f"Error loading embeddings: {str(e)}"
-        return msg if return_str else print(msg)
+        raise ValueError(f"Error loading embeddings: {str(e)}")
+    if not loaded:
+        raise ValueError(f"Failed to load embeddings for dataset {metadata.get('dataset_id')}. Please check the embeddings directory and file paths in metadata.")
     
-    if not return_str:
+    # Query-time tuning for approximate indexes
+    index_type = metadata.get('index_type', 'flat')
+    if index_type == 'hnsw':
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type == 'ivfpq':
+        index.nprobe = IVF_NPROBE
+    
+    if verbose:
         print(f"Using embedding model: {model_name}")
-        print(f"Using LLM model: {os.getenv('MODEL', 'gpt-3.5-turbo')}")
+        print(f"Using LLM model: {os.getenv('MODEL', 'gpt-4o-mini')}")
     
-    # Load model and encode query
-    model = SentenceTransformer(model_name)
-    query_embedding = model.encode([query])[0]
+    return metadata, index, processed_documents, model_name
+
+def search_many(queries: List[str], num_results: int = 5, dataset_id: str = None, verbose: bool = False) -> List[List[Tuple[float, Any]]]:
+    """Find the games most similar to each of several queries with one batched
+    FAISS search, e.g. for evaluation runs or multi-query UIs
+    Args:
+        queries: Search query strings
+        num_results: Number of results per query
+        dataset_id: Specific dataset to search
+        verbose: If True, prints the models in use
+    Returns:
+        One list of (similarity, document) pairs per query, best match first
+    Raises:
+        ValueError: If no dataset can be loaded; the message is user-facing
+    """
+    metadata, index, processed_documents, model_name = _load_search_dataset(dataset_id, verbose)
     
-    # Search using Faiss
-    D, I = index.search(query_embedding.reshape(1, -1), num_results)
+    # Encode queries. A single query goes through the memoized path; copy so that
+    # normalizing below never touches the cached vector
+    if len(queries) == 1:
+        query_vectors = np.array(_encode_query(model_name, queries[0]), dtype=np.float32).reshape(1, -1)
+    else:
+        query_vectors = np.ascontiguousarray(encode_queries(model_name, list(queries)))
     
-    # Format results
-    results = []
-    for idx, (distance, doc_idx) in enumerate(zip(D[0], I[0]), 1):
-        formatted_game = format_game_with_llm(processed_documents[doc_idx], client)
-        results.append(f"Game {idx} (similarity: {1-distance:.2f})\n{formatted_game}")
+    # Inner-product indexes hold normalized vectors, so scores are cosine similarity
+    is_cosine = metadata.get('metric', 'l2') == 'ip'
+    if is_cosine:
+        faiss.normalize_L2(query_vectors)
     
-    # For CLI output
-    if not return_str:
-        print(f"\nSearch Results:\n")
-        print("\n".join(results))
-        print("-" * 80 + "\n")
-        return None
-        
-    # For web UI output - generate conversational summary
-    combined_results = "\n\n".join(results)
-    summary_prompt = f"""
-    Based on these chess games:
-    {combined_results}
+    # Search using Faiss; a query matrix lets FAISS use its batched kernels
+    D, I = index.search(query_vectors, num_results)
     
-    Provide a concise, conversational response that:
-    1. Summarizes the key findings
-    2. Highlights interesting patterns or insights
-    3. Uses a friendly, engaging tone
-    4. Keeps the response focused and relevant to the original query: "{query}"
+    return [
+        [
+            (score if is_cosine else 1 - score, processed_documents[doc_idx])
+            for score, doc_idx in zip(scores, doc_ids)
+            if doc_idx >= 0  # FAISS pads with -1 when there are fewer hits than requested
+        ]
+        for scores, doc_ids in zip(D, I)
+    ]
+
+def retrieve_games(query: str, num_results: int = 5, dataset_id: str = None, verbose: bool = False) -> List[Tuple[float, Any]]:
+    """Find the games most similar to a query
+    Args:
+        query: Search query string
+        num_results: Number of results to return
+        dataset_id: Specific dataset to search
+        verbose: If True, prints the models in use
+    Returns:
+        List of (similarity, document) pairs, best match first
+    Raises:
+        ValueError: If no dataset can be loaded; the message is user-facing
     """
+    return search_many([query], num_results=num_results, dataset_id=dataset_id, verbose=verbose)[0]
+
+def answer_query(query: str, client: OpenAI, num_results: int = 5, dataset_id: str = None) -> str:
+    """Retrieve, format and summarize games for a query, for the web UI.
+    Raises ValueError when no usable index is available."""
+    matches = retrieve_games(query, num_results=num_results, dataset_id=dataset_id)
+    return summarize_results(query, _format_matches(matches, client), client)
+
+def _format_matches(matches: List[Tuple[float, Any]], client: OpenAI) -> List[str]:
+    # The per-game LLM calls are independent, so run them together
+    formatted_games = asyncio.run(_format_all([document for _, document in matches], client))
+    return [
+        format_result(idx, similarity, formatted_game)
+        for idx, ((similarity, _), formatted_game) in enumerate(zip(matches, formatted_games), 1)
+    ]
+
+def search_games(query: str, client: OpenAI = None, num_results: int = 5, dataset_id: str = None, return_str: bool = False) -> Union[None, str]:
+    """Search chess games using semantic search and analyze with OpenAI
+    Args:
+        query: Search query string
+        client: OpenAI client (optional - will create new one if None)
+        num_results: Number of results to return
+        dataset_id: Specific dataset to search
+        return_str: If True, returns formatted string for web UI, else prints to console
+    """
+    # Initialize OpenAI client if not provided (CLI usage)
+    if client is None:
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        if not client.api_key:
+            msg = "Error: OPENAI_API_KEY environment variable not set"
+            return msg if return_str else print(msg)
+
+    # For web UI output - generate conversational summary
+    if return_str:
+        try:
+            return answer_query(query, client, num_results=num_results, dataset_id=dataset_id)
+        except ValueError as e:
+            return str(e)
+
+    try:
+        matches = retrieve_games(query, num_results=num_results, dataset_id=dataset_id, verbose=True)
+    except ValueError as e:
+        print(str(e))
+        return None
     
-    response = client.chat.completions.create(
-        model=os.getenv('MODEL', 'gpt-3.5-turbo'),
-        messages=[
-            {"role": "system", "content": "You are a helpful chess analysis assistant providing insights about games."},
-            {"role": "user", "content": summary_prompt}
-        ],
-        temperature=0.7
-    )
-    
-    return response.choices[0].message.content
+    # For CLI output
+    print(f"\nSearch Results:\n")
+    print("\n".join(_format_matches(matches, client)))
+    print("-" * 80 + "\n")
+    return None
 
 def main():
     predefined_queries = [
@@ -0,0 +1,16 @@
+from typing import NamedTuple
+
+# Tuples rather than dicts: indexing builds hold one of these per game and per
+# chunk, and a NamedTuple costs a fraction of a dict's memory.
+# Build source names with sys.intern so every record from a file shares one string.
+
+class Game(NamedTuple):
+    """A parsed PGN game ready for chunking"""
+    description: str
+    source: str
+
+class Chunk(NamedTuple):
+    """A deduplicated piece of a game description, as embedded and stored"""
+    description: str
+    source: str
+    hash: bytes